@@ -1,37 +1,82 @@
+import errno
 import filecmp
+import gzip
+import hashlib
 import logging
 import os
-import shutil
+import stat
 import subprocess
+import tarfile
 import tempfile
+import time
 from argparse import ArgumentParser, RawTextHelpFormatter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from inspect import cleandoc
 from pathlib import Path
 from shutil import rmtree
-from subprocess import check_call, DEVNULL, STDOUT
+from subprocess import DEVNULL, STDOUT
+from typing import Iterator
 from unittest import TestCase
 
+from zgit.lib.fsutil import scan_tree
 from zgit.lib.gitutil import git_get_gitzip_file, git_get_root_directory
-from zgit.lib.testutil import shell, create_files, chdir2tmp, lstree
+from zgit.lib.testutil import shell, create_files, chdir2tmp, lstree, make_temporary_directory
+
+# Buffer size for copying file contents in and out of the archive.
+# Large pack files make tarfile's default of 16 KiB needlessly syscall-heavy.
+_COPY_BUFFER_SIZE = 2 * 1024 * 1024
+
+# Most of a .git directory consists of already zlib-compressed objects,
+# for which higher gzip levels cost CPU time without reducing the size.
+_COMPRESSION_LEVEL = 1
+
+# Files larger than this, that are not named after their content, are
+# fingerprinted by size and modification time instead of their content.
+_CONTENT_HASH_MAX_SIZE = 1024 * 1024
+
+# Unpacked repositories not used by 'zgit do' for this long are removed.
+_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# Git subcommands that never change the repository, for any arguments.
+_READ_ONLY_SUBCOMMANDS = frozenset({
+    "blame", "cat-file", "describe", "diff", "for-each-ref", "grep", "help",
+    "log", "ls-files", "ls-tree", "rev-parse", "shortlog", "show", "status",
+    "version",
+})
+
+# Git subcommands, that only list information when given without arguments.
+_READ_ONLY_WITHOUT_ARGUMENTS = frozenset({"branch", "remote", "tag"})
+
+# Git subcommands, that don't change the repository when the first argument
+# selects one of their read-only modes.
+_READ_ONLY_MODES = frozenset({
+    ("config", "--get"), ("config", "--get-all"), ("config", "--list"), ("config", "-l"),
+    ("stash", "list"), ("stash", "show"), ("worktree", "list"),
+})
+
+_DESCRIPTION = cleandoc("""
+    Dispatches one of the following subcommands:
+    
+        zgit pack
+            Convert git repository at hand to a zgit repository.
+            
+        zgit unpack
+            Reverse the packing. Useful when intending to do operations,
+            that are more easily performed on a regular zip repository.
+            
+        zgit do [--] SUBCOMMAND [ARGS...]
+            Perform a git command on the zipped git directory.
+            Internally, the repository is synchronized with a temporary
+            unzipped location. For read-only commands like 'status' or
+            'log' the zipped repository is not updated, unless the
+            environment variable ZGIT_FORCE_REPACK=1 is set.
+            
+""")
 
 
 def main():
-    parser = ArgumentParser(description=cleandoc("""
-        Dispatches one of the following subcommands:
-        
-            zgit pack
-                Convert git repository at hand to a zgit repository.
-                
-            zgit unpack
-                Reverse the packing. Useful when intending to do operations,
-                that are more easily performed on a regular zip repository.
-                
-            zgit do [--] SUBCOMMAND [ARGS...]
-                Perform a git command on the zipped git directory.
-                Internally, the repository is synchronized with a temporary
-                unzipped location.
-                
-    """), formatter_class=RawTextHelpFormatter)
+    parser = ArgumentParser(description=_DESCRIPTION, formatter_class=RawTextHelpFormatter)
     parser.add_argument("subcommand", metavar="SUBCOMMAND")
     parser.add_argument("args", nargs="*", metavar="ARGS")
     parser.add_argument("--debug", action="store_true")
@@ -97,20 +142,12 @@ def do_pack():
         logging.error("Already exists: %s", gitzip_file)
         exit(1)
 
-    # At least on windows, some files may be marked as read-only for some reason.
-    for file_path in git_dir.glob("**/*"):
-        file_path.chmod(0o777)
-
-    entries_to_add = list(git_dir.glob("*"))
-    check_call(
-        ["tar", "czf", str(gitzip_file.relative_to(git_dir)),
-         "--", *(str(p.relative_to(git_dir)) for p in entries_to_add)],
-        cwd=git_dir)
-    for path in entries_to_add:
-        if path.is_dir():
-            rmtree(path)
-        else:
-            path.unlink()
+    entries_to_add = list(git_dir.iterdir())
+    _write_archive(gitzip_file, entries_to_add)
+    # The entries are independent subtrees, so the latency of deleting
+    # many small files can be overlapped.
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        list(executor.map(_remove, entries_to_add))
 
 
 def do_unpack() -> None:
@@ -148,12 +185,434 @@ def do_unpack() -> None:
         logging.error("No such file: %s", gitzip_file)
         exit(1)
 
-    check_call(
-        ["tar", "xzf", str(gitzip_file.relative_to(git_dir))],
-        cwd=git_dir)
+    _extract_archive(gitzip_file, git_dir)
     gitzip_file.unlink()
 
 
+def _write_archive(archive_file: Path, entries: list[Path]) -> None:
+    """
+    Write the given files and directory trees to a gzipped tar archive,
+    each stored under its name at the top level of the archive.
+
+    The archive only depends on the archived files, so an unchanged
+    repository is packed to an identical file, regardless of when and
+    under which name it is written.
+
+        >>> chdir2tmp()
+        >>> create_files("repo/HEAD", "repo/refs/heads/main")
+        >>> _write_archive(Path("first.tgz"), list(Path("repo").iterdir()))
+        >>> _write_archive(Path("second.tgz"), list(Path("repo").iterdir()))
+        >>> filecmp.cmp("first.tgz", "second.tgz", shallow=False)
+        True
+    """
+    # Written as a stream, so tarfile never seeks back into the compressed
+    # output and hands data to the compressor in large blocks.
+    # The gzip header gets neither a file name nor a timestamp.
+    with open(archive_file, "wb") as raw_file, \
+            gzip.GzipFile(filename="", mode="wb", compresslevel=_COMPRESSION_LEVEL,
+                          fileobj=raw_file, mtime=0) as compressed, \
+            tarfile.open(fileobj=compressed, mode="w|", bufsize=_COPY_BUFFER_SIZE,
+                         copybufsize=_COPY_BUFFER_SIZE) as archive:
+        for path in sorted(entries):
+            archive.add(path, arcname=path.name, filter=_normalize_tarinfo)
+
+
+def _extract_archive(archive_file: Path, target_dir: Path) -> None:
+    """
+    Extract an archive written by _write_archive into target_dir,
+    which must not already contain any of the archived entries.
+
+    The archive is extracted into a temporary directory within target_dir
+    first, and only moved into place once complete, so a failed extraction
+    leaves target_dir unchanged. Any leftover of an interrupted extraction
+    thus stays out of the work tree.
+
+    Symbolic links are restored as they were packed, e.g. a .git/hooks
+    directory shared between repositories.
+
+        >>> chdir2tmp()
+        >>> create_files("shared/hooks/", "repo/HEAD")
+        >>> os.symlink(Path("shared/hooks").absolute(), "repo/hooks")
+        >>> _write_archive(Path("repo.tgz"), list(Path("repo").iterdir()))
+        >>> _extract_archive(Path("repo.tgz"), Path("unpacked"))
+        >>> sorted(path.name for path in Path().iterdir())
+        ['repo', 'repo.tgz', 'shared', 'unpacked']
+        >>> t = TestCase()
+        >>> t.assertEqual(Path("shared/hooks").absolute(), Path(os.readlink("unpacked/hooks")))
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    temporary_dir = Path(tempfile.mkdtemp(prefix="zgit-unpack.", dir=target_dir))
+    try:
+        # Detect the compression, so archives compressed differently than by
+        # do_pack, e.g. with zstd on Python versions supporting it, can be read.
+        # Read as a stream, as members are extracted in archive order anyway.
+        with tarfile.open(archive_file, "r|*", bufsize=_COPY_BUFFER_SIZE,
+                          copybufsize=_COPY_BUFFER_SIZE) as archive:
+            # Refuse entries placed outside of the extraction directory, where
+            # tarfile supports it. Unlike the stricter data_filter, symbolic
+            # links pointing elsewhere are allowed, as packed repositories
+            # may legitimately contain them.
+            archive.extraction_filter = getattr(tarfile, "tar_filter", None)
+            archive.extractall(temporary_dir)
+        for path in temporary_dir.iterdir():
+            path.rename(target_dir / path.name)
+    finally:
+        _remove(temporary_dir)
+
+
+def _normalize_tarinfo(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+    """
+    Archive filter, that stores entries as writable by the owner,
+    and without information about the user packing the repository.
+
+    Git marks object files as read-only, which on Windows prevents deleting
+    them after unpacking.
+
+    Modification times are kept, as git relies on them, e.g. for the grace
+    period before pruning unreferenced objects.
+    """
+    tarinfo.mode |= stat.S_IWUSR
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    return tarinfo
+
+
+def _remove(path: Path) -> None:
+    """
+    Delete a file or directory tree, including files marked as read-only.
+
+    Symbolic links are removed themselves, leaving their target untouched.
+
+        >>> chdir2tmp()
+        >>> create_files("shared/file", "git/objects/")
+        >>> os.symlink(Path("shared").absolute(), "git/shared")
+        >>> _remove(Path("git/shared"))
+        >>> _remove(Path("git/objects"))
+        >>> lstree()
+         |- git/
+         '- shared/
+             '- file
+    """
+    if path.is_dir() and not path.is_symlink():
+        rmtree(path, onerror=_make_writable_and_retry)
+    else:
+        try:
+            path.unlink()
+        except PermissionError as error:
+            _make_writable_and_retry(os.unlink, path, (type(error), error, error.__traceback__))
+
+
+def _make_writable_and_retry(function, path, excinfo) -> None:
+    """
+    Error handler for deleting files, that may be marked as read-only.
+
+    At least on windows, git marks some files as read-only, which prevents
+    deleting them. Only files, whose deletion actually failed, are made
+    writable, so the common case costs no extra system calls.
+
+    Any other error is raised again.
+    """
+    if function not in (os.unlink, os.remove, os.rmdir) or not issubclass(excinfo[0], PermissionError):
+        raise excinfo[1]
+    mode = stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IWUSR
+    if os.chmod in os.supports_follow_symlinks:
+        os.chmod(path, mode, follow_symlinks=False)
+    elif not os.path.islink(path):  # Would change the target instead.
+        os.chmod(path, mode)
+    function(path)
+
+
+def _scan_repository(
+        git_dir: Path,
+        with_snapshot: bool = True,
+) -> tuple[bytes, dict[str, tuple[int, int, int]]]:
+    """
+    Record the state of a git directory for detecting changes,
+    in a single pass over its files.
+
+    :param with_snapshot:
+        If false, the returned snapshot is empty, saving a stat call per
+        object file.
+    :return:
+        Pair of a fingerprint and a snapshot of the directory.
+
+        The fingerprint is a digest of the content, mostly independent of
+        file timestamps. Loose objects, pack files and LFS objects are named
+        after the hash of their content, so only their names are hashed.
+        Symbolic links are hashed by their target. Other files are hashed
+        including their content, except for files larger than
+        _CONTENT_HASH_MAX_SIZE, for which size and modification time are
+        hashed instead, unless they are an index or packed-refs file.
+        Commands that rewrite files without changing them, e.g. 'git gc' on
+        an already packed repository, thus leave the fingerprint unchanged.
+
+        The snapshot maps '/'-separated paths relative to git_dir to
+        (st_mtime_ns, st_size, st_ino), for reporting which files changed.
+        Access times are deliberately left out, as merely reading a file
+        may update them.
+
+    Consider some example directory,
+
+        >>> chdir2tmp()
+        >>> create_files("HEAD", "objects/ab/cdef", "refs/heads/")
+        >>> fingerprint, snapshot = _scan_repository(Path.cwd())
+
+    Directories themselves are not recorded in the snapshot, only the files within.
+
+        >>> sorted(snapshot)
+        ['HEAD', 'objects/ab/cdef']
+
+    Changes to object files are only reflected by the snapshot,
+
+        >>> _ = Path("objects/ab/cdef").write_text("content is not read")
+        >>> t = TestCase()
+        >>> t.assertEqual(fingerprint, _scan_repository(Path.cwd())[0])
+
+    while changes to other files also change the fingerprint.
+
+        >>> _ = Path("HEAD").write_text("ref: refs/heads/main")
+        >>> t.assertNotEqual(fingerprint, _scan_repository(Path.cwd())[0])
+
+    Symbolic links are not followed, even when pointing to directories.
+
+        >>> create_files("shared/hooks/")
+        >>> os.symlink(Path("shared/hooks").absolute(), "hooks")
+        >>> "hooks" in _scan_repository(Path.cwd())[1]
+        True
+    """
+    digest = hashlib.blake2b()
+    snapshot: dict[str, tuple[int, int, int]] = {}
+    for entry, relative_path in scan_tree(git_dir, sort=True):
+        if entry.is_dir(follow_symlinks=False):
+            continue
+        digest.update(relative_path.encode() + b"\0")
+        content_addressed = _is_content_addressed(relative_path)
+        if content_addressed and not with_snapshot:
+            continue
+        entry_stat = entry.stat(follow_symlinks=False)
+        if with_snapshot:
+            snapshot[relative_path] = (entry_stat.st_mtime_ns, entry_stat.st_size, entry_stat.st_ino)
+        if content_addressed:
+            continue
+        if entry.is_symlink():
+            digest.update(b"link:" + os.fsencode(os.readlink(entry.path)))
+        elif (entry_stat.st_size > _CONTENT_HASH_MAX_SIZE and
+              relative_path.rpartition("/")[2] not in ("index", "packed-refs")):
+            digest.update(b"stat:%d:%d" % (entry_stat.st_size, entry_stat.st_mtime_ns))
+        else:
+            digest.update(b"file:" + _hash_file(entry.path))
+    return digest.digest(), snapshot
+
+
+def _hash_file(path: str) -> bytes:
+    """
+    :return: Digest of the content of the given file, read in chunks.
+    """
+    file_digest = hashlib.blake2b()
+    with open(path, "rb") as file:
+        while chunk := file.read(_COPY_BUFFER_SIZE):
+            file_digest.update(chunk)
+    return file_digest.digest()
+
+
+def _is_content_addressed(relative_path: str) -> bool:
+    """
+    Check, whether a path relative to the git directory denotes a file named
+    after the hash of its content.
+
+    Object stores of submodules and LFS objects are recognized as well.
+
+        >>> _is_content_addressed("objects/ab/cdef0123")
+        True
+        >>> _is_content_addressed("objects/pack/pack-0123.pack")
+        True
+        >>> _is_content_addressed("modules/sub/objects/pack/pack-0123.pack")
+        True
+        >>> _is_content_addressed("lfs/objects/ab/cd/abcdef0123")
+        True
+        >>> _is_content_addressed("objects/pack/multi-pack-index")
+        False
+        >>> _is_content_addressed("objects/info/commit-graph")
+        False
+        >>> _is_content_addressed("refs/heads/objects/ab/cdef0123")
+        False
+        >>> _is_content_addressed("modules/sub/logs/refs/heads/objects/ab/cdef0123")
+        False
+    """
+    parts = relative_path.split("/")
+    if "objects" not in parts:
+        return False
+    index = len(parts) - 1 - parts[::-1].index("objects")
+    if "refs" in parts[:index]:
+        return False  # e.g. a branch named 'objects/...'
+    if index > 0 and parts[index - 1] == "lfs":
+        return True
+    rest = parts[index + 1:]
+    return len(rest) == 2 and (
+        len(rest[0]) == 2 or
+        rest[0] == "pack" and rest[1].startswith("pack-"))
+
+
+def _find_git_executable() -> str:
+    """
+    Resolve the git executable on $PATH.
+
+    Unlike shutil.which, only a single name is probed per directory, instead
+    of trying every extension in %PATHEXT% on windows.
+
+    Falls back to plain "git", so that a missing executable is still reported
+    by the subprocess call.
+    """
+    executable_name = "git.exe" if os.name == "nt" else "git"
+    for directory in os.get_exec_path():
+        candidate = os.path.join(directory, executable_name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return "git"
+
+
+def _call_git(args: list[str], git_dir: Path) -> int:
+    """
+    Run git with the given arguments on the given git directory,
+    which must be given as an absolute path.
+
+    :return: Exit code of git.
+    """
+    env = os.environ.copy()
+    env["GIT_DIR"] = os.fspath(git_dir)
+    # With an absolute executable path and close_fds=False, CPython spawns
+    # the process using posix_spawn, avoiding fork() of this process.
+    # Our own file descriptors are non-inheritable by default anyway.
+    return subprocess.call([_find_git_executable(), *args], env=env, close_fds=False)
+
+
+def _is_read_only_command(args: list[str]) -> bool:
+    """
+    Check, whether the git command line is known to leave the repository
+    unchanged, so updating the archive afterwards can be skipped.
+
+    Subcommands that modify the repository for some arguments, e.g.
+    'git config' or 'git tag', are only considered read-only for arguments
+    that select one of their listing modes.
+
+        >>> _is_read_only_command(["log", "--oneline"])
+        True
+        >>> _is_read_only_command(["commit", "-m", "message"])
+        False
+        >>> _is_read_only_command(["-c", "user.name=me", "log"])
+        False
+        >>> _is_read_only_command(["tag"])
+        True
+        >>> _is_read_only_command(["tag", "v1.0"])
+        False
+        >>> _is_read_only_command(["stash", "list"])
+        True
+        >>> _is_read_only_command(["stash"])
+        False
+        >>> _is_read_only_command(["config", "--get", "user.name"])
+        True
+        >>> _is_read_only_command(["config", "user.name", "me"])
+        False
+    """
+    return (
+        len(args) > 0 and args[0] in _READ_ONLY_SUBCOMMANDS or
+        len(args) == 1 and args[0] in _READ_ONLY_WITHOUT_ARGUMENTS or
+        tuple(args[:2]) in _READ_ONLY_MODES)
+
+
+def _cache_directory(gitzip_file: Path) -> Path:
+    """
+    :return: Directory, where the unpacked copy of the given archive is kept
+        between invocations of 'zgit do'.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    key = hashlib.blake2s(str(gitzip_file.absolute()).encode()).hexdigest()[:16]
+    return Path(cache_home).absolute() / "zgit" / key
+
+
+def _evict_unused_caches(current_cache_root: Path) -> None:
+    """
+    Remove the unpacked repositories next to current_cache_root, that have not
+    been used for _CACHE_MAX_AGE_SECONDS, e.g. because the archive was moved
+    or deleted.
+
+    Caches locked by another process are skipped. The lock file is kept,
+    as another process may be waiting for it.
+    """
+    expiry_time = time.time() - _CACHE_MAX_AGE_SECONDS
+    for cache_root in current_cache_root.parent.iterdir():
+        lock_file = cache_root / "lock"
+        if cache_root == current_cache_root:
+            continue  # Already locked by us.
+        if not (cache_root / ".git").exists() and not (cache_root / "stamp").exists():
+            continue  # Nothing left to remove.
+        if not lock_file.exists() or lock_file.stat().st_mtime >= expiry_time:
+            continue
+        try:
+            # Waiting here, while holding our own lock, could deadlock with
+            # another process evicting caches.
+            with _locked(lock_file, blocking=False):
+                if lock_file.stat().st_mtime >= expiry_time:
+                    continue  # Used in the meantime.
+                logging.info("Removing unused cache %s", cache_root)
+                for path in cache_root.iterdir():
+                    if path != lock_file:
+                        _remove(path)
+        except BlockingIOError:
+            continue  # In use right now.
+
+
+def _archive_stamp(archive_stat: os.stat_result) -> str:
+    """
+    Identify a version of the archive file, for checking whether an
+    unpacked copy is up to date.
+    """
+    return f"{archive_stat.st_mtime_ns}:{archive_stat.st_size}:{archive_stat.st_ino}"
+
+
+@contextmanager
+def _locked(lock_file: Path, blocking: bool = True) -> Iterator[None]:
+    """
+    Context manager, that holds an exclusive lock on lock_file,
+    waiting for other processes to release it first.
+
+    :param blocking:
+        If false, BlockingIOError is raised instead of waiting,
+        when the lock is held elsewhere.
+
+        >>> chdir2tmp()
+        >>> with _locked(Path("lock")):
+        ...     with _locked(Path("lock"), blocking=False):
+        ...         pass
+        Traceback (most recent call last):
+        BlockingIOError: ...
+    """
+    with open(lock_file, "a+b") as file:
+        if os.name == "nt":
+            import msvcrt
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError as error:
+                    if not blocking and error.errno == errno.EACCES:
+                        raise BlockingIOError(errno.EAGAIN, "Locked elsewhere", str(lock_file)) from error
+                    # LK_LOCK gives up after retrying for 10 seconds, while
+                    # the lock may be held e.g. during a commit message editor.
+                    if not blocking or error.errno != errno.EDEADLOCK:
+                        raise
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            yield  # Released by closing the file.
+
+
 def do_wrapped_subcommand(args: list[str]):
     """
     Execute git command on the unpacked git repository.
@@ -161,8 +620,14 @@ def do_wrapped_subcommand(args: list[str]):
     If the git repository has changed after the command, update the
     single-file repository.
 
-    Let us demonstrate with a dummy git repository:
+    The unpacked repository is kept in $XDG_CACHE_HOME/zgit (by default
+    ~/.cache/zgit) between invocations, and only unpacked again when the
+    single-file repository has changed in the meantime.
 
+    Let us demonstrate with a dummy git repository, keeping the unpacked
+    copy in a temporary cache directory:
+
+        >>> env = {**os.environ, "XDG_CACHE_HOME": str(make_temporary_directory(prefix="zgit-cache."))}
         >>> chdir2tmp()
         >>> create_files("main.c", "lib/string.h", "lib/string.c")
         >>> shell('git init', stdout=DEVNULL)
@@ -173,38 +638,74 @@ def do_wrapped_subcommand(args: list[str]):
     A command that does not change the repository, will leave the repository file
     untouched.
 
-        >>> mtime_before = Path(".git/zgit.tgz").stat().st_mtime
-        >>> shell("zgit do status")
+        >>> mtime_before = Path(".git/zgit.tgz").stat().st_mtime_ns
+        >>> shell("zgit do status", env=env)
         On branch ...
         nothing to commit, working tree clean
         >>> t = TestCase()
-        >>> t.assertEqual(mtime_before, Path(".git/zgit.tgz").stat().st_mtime)
+        >>> t.assertEqual(mtime_before, Path(".git/zgit.tgz").stat().st_mtime_ns)
+
+    Neither does repeating such a command.
+
+        >>> shell("zgit do status", env=env, stdout=DEVNULL)
+        >>> t.assertEqual(mtime_before, Path(".git/zgit.tgz").stat().st_mtime_ns)
+
+    Commands that do change the repository update the repository file.
+
+        >>> create_files("README")
+        >>> shell("zgit do add README", env=env)
+        >>> shell('zgit do -- commit -m "add readme"', env=env, stdout=DEVNULL)
+        >>> shell("zgit unpack")
+        >>> shell("git log --format=%s")
+        add readme
+        initial commit
     """
     gitzip_file: Path = git_get_gitzip_file()
+    if gitzip_file is None:
+        logging.error("Not inside a git repository: %s", Path.cwd())
+        exit(1)
     if not gitzip_file.exists():
         logging.error("No such file: %s", gitzip_file)
         exit(1)
 
-    gitzip_file_stat = gitzip_file.stat()
-
-    with tempfile.TemporaryDirectory(prefix="zgit.repository.") as temp_root:
-        temp_root: Path = Path(temp_root)
-        temp_repo: Path = temp_root / ".git"
-        temp_repo.mkdir()
-        temp_repo_file: Path = git_get_gitzip_file(relative_to=temp_root)
-        shutil.copyfile(src=gitzip_file, dst=temp_repo_file)
-        check_call(["zgit", "unpack"], stdout=DEVNULL, cwd=temp_root)
-        state_before_command = {
-            path: path.stat().st_mtime
-            for path in temp_repo.glob("**/*")
-        }
-        git_exit_code: int = subprocess.call(
-            ["git", *args],
-            env={**os.environ, "GIT_DIR": str(temp_repo.absolute())})
-        state_after_command = {
-            path: path.stat().st_mtime
-            for path in temp_repo.glob("**/*")
-        }
+    cache_root: Path = _cache_directory(gitzip_file)
+    cache_root.mkdir(parents=True, exist_ok=True)
+    cache_repo: Path = cache_root / ".git"
+    stamp_file: Path = cache_root / "stamp"
+    lock_file: Path = cache_root / "lock"
+
+    with _locked(lock_file):
+        os.utime(lock_file)  # Mark as recently used.
+        gitzip_file_stat = gitzip_file.stat()
+        if (cache_repo.is_dir() and stamp_file.exists() and
+                stamp_file.read_text() == _archive_stamp(gitzip_file_stat)):
+            logging.info("Reusing unpacked repository at %s", cache_repo)
+        else:
+            logging.info("Unpacking %s to %s...", gitzip_file, cache_repo)
+            # Invalidated first, so a failed extraction is not mistaken
+            # for an up-to-date copy next time.
+            stamp_file.unlink(missing_ok=True)
+            if cache_repo.exists():
+                _remove(cache_repo)
+            _extract_archive(gitzip_file, cache_repo)
+            stamp_file.write_text(_archive_stamp(gitzip_file_stat))
+            _evict_unused_caches(cache_root)
+
+        if _is_read_only_command(args) and os.environ.get("ZGIT_FORCE_REPACK") != "1":
+            logging.info("Read-only command, %s will not be updated.", gitzip_file)
+            exit(_call_git(args, git_dir=cache_repo))
+
+        # Until the archive is known to match the unpacked copy again,
+        # mark the copy as outdated, so it is unpacked anew next time.
+        stamp_file.unlink()
+
+        # The snapshots only serve for reporting the changed files.
+        report_changes: bool = logging.getLogger().isEnabledFor(logging.INFO)
+        fingerprint_before_command, state_before_command = _scan_repository(
+            cache_repo, with_snapshot=report_changes)
+        git_exit_code: int = _call_git(args, git_dir=cache_repo)
+        fingerprint_after_command, state_after_command = _scan_repository(
+            cache_repo, with_snapshot=report_changes)
 
         logging.info("Checking if repository has been changed by other command...")
         is_zip_command: bool = len(args) > 0 and args[0] == "zip"
@@ -212,34 +713,50 @@ def do_wrapped_subcommand(args: list[str]):
             if not gitzip_file.exists():
                 logging.error("File has been removed by some other command: %s", gitzip_file)
                 exit(1)
-            if not gitzip_file_stat.st_mtime == gitzip_file.stat().st_mtime:
+            mtime_ns_after_command: int = gitzip_file.stat().st_mtime_ns
+            if gitzip_file_stat.st_mtime_ns != mtime_ns_after_command:
                 logging.error("File has been changed by some other command: %s", gitzip_file)
+                logging.error("  mtime before: %d ns", gitzip_file_stat.st_mtime_ns)
+                logging.error("  mtime after:  %d ns", mtime_ns_after_command)
                 exit(1)
 
         logging.info("Looking for differences...")
-        repository_has_changed: bool = False
-        for path in sorted(set(state_before_command) | set(state_after_command)):
-            if not path in state_before_command:
-                logging.info("New file: %s", path)
-                repository_has_changed = True
-            elif not path in state_after_command:
+        repository_has_changed: bool = fingerprint_before_command != fingerprint_after_command
+        if not repository_has_changed:
+            logging.info("Repository content is unchanged, ignoring file modification times.")
+        elif report_changes:
+            # Entries found in both snapshots are popped from the earlier one,
+            # so a single pass over each suffices. New and changed files are
+            # reported first, removed files afterwards.
+            for path, state_after in state_after_command.items():
+                state_before = state_before_command.pop(path, None)
+                if state_before is None:
+                    logging.info("New file: %s", path)
+                elif state_before != state_after:
+                    logging.info("File has changed: %s", path)
+                    logging.info("  Before: %s", state_before)
+                    logging.info("  After:  %s", state_after)
+            for path in state_before_command:
                 logging.info("File removed: %s", path)
-                repository_has_changed = True
-            elif state_before_command[path] != state_after_command[path]:
-                logging.info("File mtime has changed: %s", path)
-                logging.info("  Before: %s", state_before_command[path])
-                logging.info("  After:  %s", state_after_command[path])
-                repository_has_changed = True
 
         if not repository_has_changed:
             logging.info("Repository did not change, no update needed.")
         else:
             logging.info("Repository changed, updating %s...", gitzip_file)
-            check_call(["zgit", "pack"], stdout=DEVNULL, cwd=temp_root)
-            temp_repo_file.replace(target=gitzip_file)
-
-        if git_exit_code != 0:
-            exit(git_exit_code)
+            # Written next to the archive, so replacing it is an atomic rename.
+            new_gitzip_file: Path = gitzip_file.with_name(gitzip_file.name + ".new")
+            try:
+                _write_archive(new_gitzip_file, list(cache_repo.iterdir()))
+            except BaseException:
+                # Otherwise e.g. a later 'zgit pack' would archive it.
+                new_gitzip_file.unlink(missing_ok=True)
+                raise
+            new_gitzip_file.replace(gitzip_file)
+
+        stamp_file.write_text(_archive_stamp(gitzip_file.stat()))
+
+    if git_exit_code != 0:
+        exit(git_exit_code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+from typing import Iterator, Union
+
+
+def scan_directory(directory: Union[str, Path], sort: bool = False) -> list[os.DirEntry]:
+    """
+    List the entries of a directory, optionally sorted by name.
+
+    Based on os.scandir, so whether an entry is a directory is known from
+    the directory listing, without an additional stat call per entry.
+
+        >>> from zgit.lib.testutil import chdir2tmp, create_files
+        >>> chdir2tmp(prefix="scan_directory.")
+        >>> create_files("b.txt", "a/")
+        >>> [entry.name for entry in scan_directory(Path.cwd(), sort=True)]
+        ['a', 'b.txt']
+    """
+    with os.scandir(directory) as iterator:
+        return sorted(iterator, key=lambda entry: entry.name) if sort else list(iterator)
+
+
+def scan_tree(root: Path, sort: bool = False) -> Iterator[tuple[os.DirEntry, str]]:
+    """
+    Iterate over all files and directories below root, parents before children.
+
+    :param root:
+        Directory to scan.
+    :param sort:
+        If true, the entries of each directory are visited in order of their
+        names, making the order of iteration reproducible.
+    :return:
+        Iterator over pairs of the os.DirEntry and the path relative to root,
+        which is '/'-separated on all platforms.
+
+    Consider an example directory,
+
+        >>> from zgit.lib.testutil import chdir2tmp, create_files
+        >>> chdir2tmp(prefix="scan_tree.")
+        >>> create_files("b.txt", "a/c.txt", "a/d/")
+
+    Then all entries are visited.
+
+        >>> [relative_path for _, relative_path in scan_tree(Path.cwd(), sort=True)]
+        ['a', 'a/c.txt', 'a/d', 'b.txt']
+    """
+    def scan(directory: str, prefix: str) -> Iterator[tuple[os.DirEntry, str]]:
+        for entry in scan_directory(directory, sort=sort):
+            relative_path = prefix + entry.name
+            yield entry, relative_path
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(entry.path, relative_path + "/")
+
+    return scan(str(root), "")
@@ -1,3 +1,4 @@
+import os
 import tempfile
 from os import chdir
 from pathlib import Path
@@ -37,16 +38,19 @@ def git_get_root_directory(relative_to: Optional[Path] = None) -> Optional[Path]
         ...     t.assertEqual(repo_path, git_get_root_directory())
 
     """
-    current: Path = (
+    current: str = os.path.abspath(
         Path.cwd() if relative_to is None else
         relative_to)
-
-    if current.joinpath(".git").exists():
-        return current
-    elif current.parent == current:  # reached root directory
-        return None
-    else:
-        return git_get_root_directory(current.parent)
+    while True:
+        try:
+            os.stat(os.path.join(current, ".git"))
+            return Path(current)
+        except OSError:  # e.g. FileNotFoundError, or NotADirectoryError for files
+            pass
+        parent = os.path.dirname(current)
+        if parent == current:  # reached root directory
+            return None
+        current = parent
 
 
 def git_get_gitzip_file(relative_to: Optional[Path] = None) -> Optional[Path]:
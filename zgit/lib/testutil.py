@@ -9,6 +9,8 @@ from subprocess import check_call, PIPE
 from tempfile import TemporaryDirectory
 from typing import Union, Iterator, Optional, Iterable, Any
 
+from zgit.lib.fsutil import scan_directory
+
 
 @contextmanager
 def using_cwd(new_cwd: Union[Path, str]) -> Iterator[None]:
@@ -87,13 +89,16 @@ def create_files(*filenames: str, cwd: Path = None):
         Path.cwd() if cwd is None else
         Path(cwd))
 
+    # Create each directory only once, even if shared by many files.
+    directories = {
+        cwd / filename if filename.endswith("/") else (cwd / filename).parent
+        for filename in filenames}
+    for directory in sorted(directories):
+        directory.mkdir(parents=True, exist_ok=True)
+
     for filename in filenames:
-        full_path = cwd / filename
-        full_path.parent.mkdir(parents=True, exist_ok=True)
-        if filename.endswith("/"):
-            full_path.mkdir(exist_ok=True)
-        else:
-            full_path.touch(exist_ok=True)
+        if not filename.endswith("/"):
+            os.close(os.open(cwd / filename, os.O_WRONLY | os.O_CREAT, 0o666))
 
 
 def make_temporary_directory(*args, **kwargs) -> Path:
@@ -157,20 +162,19 @@ def ls(
         Path.cwd() if root is None else
         Path(root))
 
-    def print_recursively(path: Path):
-        path_string: str = str(path.relative_to(root)).replace(os.sep, "/")
-        if not path.is_dir():
+    def print_recursively(entry: os.DirEntry, path_string: str):
+        if not entry.is_dir(follow_symlinks=False):
             print(path_string)
         else:
-            entries = sorted(path.glob("*"))
+            entries = scan_directory(entry.path, sort=True)
             if entries and recursive:
-                for entry in entries:
-                    print_recursively(entry)
+                for child in entries:
+                    print_recursively(child, path_string + "/" + child.name)
             else:
                 print(path_string + "/")
 
-    for entry in root.glob("*"):
-        print_recursively(entry)
+    for entry in scan_directory(root, sort=True):
+        print_recursively(entry, entry.name)
 
 
 def lstree(root: Optional[Union[str, Path]] = None):
@@ -195,22 +199,25 @@ def lstree(root: Optional[Union[str, Path]] = None):
 
     assert root.is_dir()
 
-    def recur(directory: Path, prefix0: str = "", prefix1: str = ""):
-        assert directory.is_dir()
-        entries = sorted(directory.glob("*"))
-        for idx, entry in enumerate(entries):
-            is_last: bool = idx == len(entries) - 1
-            if not entry.is_dir():
-                if is_last:
-                    print(prefix1 + " '- " + entry.name)
-                else:
-                    print(prefix1 + " |- " + entry.name)
-            else:
-                if is_last:
-                    print(prefix1 + " '- " + entry.name + "/")
-                    recur(entry, prefix0=prefix1 + " '- ", prefix1=prefix1 + "    ")
-                else:
-                    print(prefix1 + " |- " + entry.name + "/")
-                    recur(entry, prefix0=prefix1 + " |- ", prefix1=prefix1 + " |  ")
-
-    recur(root)
+    # Iterative depth-first traversal; entries are pushed in reverse order,
+    # so that they are popped in sorted order.
+    lines: list[str] = []
+    pending: list[tuple[os.DirEntry, bool, str]] = []
+
+    def push_entries(directory: Union[str, Path], prefix: str):
+        entries = scan_directory(directory, sort=True)
+        for idx in reversed(range(len(entries))):
+            pending.append((entries[idx], idx == len(entries) - 1, prefix))
+
+    push_entries(root, "")
+    while pending:
+        entry, is_last, prefix = pending.pop()
+        branch: str = " '- " if is_last else " |- "
+        if not entry.is_dir(follow_symlinks=False):
+            lines.append(prefix + branch + entry.name)
+        else:
+            lines.append(prefix + branch + entry.name + "/")
+            push_entries(entry.path, prefix + ("    " if is_last else " |  "))
+
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")